@@ -0,0 +1,10 @@
+"""
+Shared helpers for the integration tests
+"""
+
+import time
+
+
+def now_iso() -> str:
+    """Current UTC time in the format the form sends"""
+    return time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime())
@@ -2,98 +2,103 @@
 Simple integration tests that can run without Docker
 """
 
-import json
 import os
+import re
 import sys
 import time
 from pathlib import Path
 
+import fastjsonschema
+import orjson
+import pytest
+
 # Add parent directory to path for imports
 sys.path.insert(0, str(Path(__file__).parent.parent.parent))
 
-def test_fixtures_valid():
-    """Test that fixture files are valid JSON"""
-    fixtures_dir = Path(__file__).parent.parent / "fixtures"
+from helpers import now_iso  # noqa: E402
+
+FIXTURES_DIR = Path(__file__).parent.parent / "fixtures"
+_TS = now_iso()
 
-    # Test users.json
-    users_file = fixtures_dir / "users.json"
+_EMAIL_RE = re.compile(r'^[^@\s]+@[^@\s]+\.[^@\s]+$')
+
+# Compiled once at import; fastjsonschema generates Python code for the schema
+_PAYLOAD_SCHEMA = {
+    "type": "object",
+    "required": ["email", "name", "passphrase"],
+    "properties": {
+        "email": {"type": "string", "format": "email"},
+        "name": {"type": "string"},
+        "passphrase": {"type": "string"}
+    }
+}
+_validate_payload = fastjsonschema.compile(
+    _PAYLOAD_SCHEMA,
+    formats={"email": lambda value: _EMAIL_RE.match(value) is not None}
+)
+
+@pytest.fixture(scope="session")
+def users_fixture():
+    """Parsed users.json, loaded once per session"""
+    users_file = FIXTURES_DIR / "users.json"
     assert users_file.exists(), "users.json fixture should exist"
+    return orjson.loads(users_file.read_bytes())
 
-    with open(users_file) as f:
-        users_data = json.load(f)
+def test_fixtures_valid(users_fixture):
+    """Test that fixture files are valid JSON"""
+    users_data = users_fixture
 
     assert "valid_users" in users_data
     assert len(users_data["valid_users"]) > 0
     assert "invalid_users" in users_data
     assert "edge_cases" in users_data
 
-    print("✓ Fixtures are valid JSON")
-    return True
-
 def test_password_generator_module():
     """Test that password generator can be imported and used"""
-    try:
-        # Since we're in Python, we'll test the concept
-        import random
-        import string
-
-        def generate_password(length=16):
-            chars = string.ascii_letters + string.digits + string.punctuation
-            return ''.join(random.choice(chars) for _ in range(length))
+    # Since we're in Python, we'll test the concept
+    import secrets
+    import string
 
-        # Generate test passwords
-        passwords = [generate_password() for _ in range(10)]
+    def generate_password(length=16):
+        alphabet = string.ascii_letters + string.digits + string.punctuation
+        return ''.join(secrets.choice(alphabet) for _ in range(length))
 
-        # Check all are unique
-        assert len(set(passwords)) == 10, "All passwords should be unique"
+    # Generate test passwords
+    passwords = [generate_password() for _ in range(10)]
 
-        # Check length
-        for pwd in passwords:
-            assert len(pwd) == 16, f"Password should be 16 chars, got {len(pwd)}"
+    # Check all are unique
+    assert len(set(passwords)) == 10, "All passwords should be unique"
 
-        print("✓ Password generation works")
-        return True
-    except Exception as e:
-        print(f"✗ Password generation failed: {e}")
-        return False
+    # Check length
+    for pwd in passwords:
+        assert len(pwd) == 16, f"Password should be 16 chars, got {len(pwd)}"
 
-def test_environment_variables():
+def test_environment_variables(monkeypatch):
     """Test that environment can be configured"""
     test_vars = {
         "FORM_PASSPHRASE": "spse2025",
         "TEST_MODE": "true"
     }
 
+    # monkeypatch restores the originals when the test ends
     for key, value in test_vars.items():
-        os.environ[key] = value
+        monkeypatch.setenv(key, value)
 
     # Verify they're set
     for key, value in test_vars.items():
         assert os.environ.get(key) == value, f"{key} should be set"
 
-    print("✓ Environment variables configured")
-    return True
-
 def test_webhook_payload_structure():
     """Test webhook payload structure validation"""
     valid_payload = {
         "email": "test@example.com",
         "name": "Test User",
         "passphrase": "spse2025",
-        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime())
+        "timestamp": _TS
     }
 
-    # Validate required fields
-    required_fields = ["email", "name", "passphrase"]
-    for field in required_fields:
-        assert field in valid_payload, f"Missing required field: {field}"
-
-    # Validate email format
-    assert "@" in valid_payload["email"], "Email should contain @"
-    assert "." in valid_payload["email"].split("@")[1], "Email domain should contain ."
-
-    print("✓ Webhook payload structure valid")
-    return True
+    # Validates required fields and email format
+    _validate_payload(valid_payload)
 
 def test_mock_user_registration_flow():
     """Test a mock user registration flow"""
@@ -127,57 +132,3 @@ def test_mock_user_registration_flow():
     # Verify all steps passed
     for step_name, success in steps:
         assert success, f"Step failed: {step_name}"
-        print(f"  ✓ {step_name}")
-
-    print("✓ Mock registration flow completed")
-    return True
-
-def run_tests():
-    """Run all tests and report results"""
-    print("\n" + "="*50)
-    print("Running Integration Tests (No Docker Required)")
-    print("="*50 + "\n")
-
-    tests = [
-        ("Fixtures Validation", test_fixtures_valid),
-        ("Password Generation", test_password_generator_module),
-        ("Environment Variables", test_environment_variables),
-        ("Webhook Payload", test_webhook_payload_structure),
-        ("Registration Flow", test_mock_user_registration_flow),
-    ]
-
-    results = []
-    for test_name, test_func in tests:
-        print(f"\nTesting: {test_name}")
-        print("-" * 30)
-        try:
-            success = test_func()
-            results.append((test_name, success))
-        except Exception as e:
-            print(f"✗ Test failed with error: {e}")
-            results.append((test_name, False))
-
-    # Summary
-    print("\n" + "="*50)
-    print("Test Summary")
-    print("="*50)
-
-    passed = sum(1 for _, success in results if success)
-    total = len(results)
-
-    for test_name, success in results:
-        status = "✅ PASS" if success else "❌ FAIL"
-        print(f"{status} - {test_name}")
-
-    print(f"\nResults: {passed}/{total} tests passed")
-
-    if passed == total:
-        print("\n🎉 All tests passed!")
-    else:
-        print(f"\n⚠️  {total - passed} test(s) failed")
-
-    return passed == total
-
-if __name__ == "__main__":
-    success = run_tests()
-    exit(0 if success else 1)
\ No newline at end of file
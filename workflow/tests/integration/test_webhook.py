@@ -4,80 +4,199 @@ Tests the complete webhook flow with n8n
 """
 
 import pytest
+import pytest_asyncio
 import requests
-import json
+import httpx
+import asyncio
+import math
 import time
+import orjson
 import os
-from typing import Dict, Any
+import socket
+from typing import List, Optional
+from urllib.parse import urlparse
+
+from helpers import now_iso
 
 # Test configuration
 WEBHOOK_URL = os.getenv('WEBHOOK_URL', 'http://localhost:5679/webhook/google-forms-webhook')
 N8N_URL = os.getenv('N8N_URL', 'http://localhost:5679')
 PASSPHRASE = os.getenv('FORM_PASSPHRASE', 'spse2025')
 TIMEOUT = 30
+# p95 latency budget for webhook posts, enforced when CI_PERF_GATE is set
+LATENCY_P95_BUDGET_MS = int(os.getenv('WEBHOOK_P95_BUDGET_MS', '500'))
+# Below this many samples a p95 is just the slowest call, so the gate is skipped
+LATENCY_MIN_SAMPLES = 20
+
+# For payloads where the timestamp is decorative
+_TS = now_iso()
+
+_JSON_HEADERS = {'Content-Type': 'application/json'}
+
+# Baseline registration payload; tests override only what they exercise
+_DEFAULT_PAYLOAD = {
+    "email": "test@example.com",
+    "name": "Test User",
+    "passphrase": PASSPHRASE
+}
+_DEFAULT_BODY = orjson.dumps(_DEFAULT_PAYLOAD)
+
+# Pre-encoded once; 10KB of extra data for the large payload test
+_LARGE_BODY = orjson.dumps({**_DEFAULT_PAYLOAD, "extra_data": "x" * 10000})
+
+# Set once n8n has answered its health check in this process
+_n8n_ready = False
+
+# Per-call durations of _post in nanoseconds, checked by _latency_gate.
+# The async burst tests are left out on purpose: their requests queue behind
+# each other (and the rate limiter), so their timings measure the burst, not
+# the per-request latency the budget is about.
+_latencies: List[int] = []
+
+
+def wait_for_service(url: str, max_wait: float = 30):
+    """Wait for service to be available"""
+    deadline = time.monotonic() + max_wait
+    parsed = urlparse(url)
+    address = (parsed.hostname, parsed.port or (443 if parsed.scheme == 'https' else 80))
+
+    # Cheap TCP probe first, so we don't pile up HTTP timeouts before the
+    # port is even listening
+    while True:
+        try:
+            socket.create_connection(address, timeout=0.1).close()
+            break
+        except OSError:
+            pass
+        if time.monotonic() >= deadline:
+            raise TimeoutError(f"Service {url} not listening after {max_wait} seconds")
+        time.sleep(0.05)
+
+    # Then the real health check, backing off exponentially
+    delay = 0.05
+    while True:
+        try:
+            response = requests.get(url, timeout=2)
+            if response.status_code == 200:
+                return
+        except requests.exceptions.RequestException:
+            pass
+        if time.monotonic() >= deadline:
+            raise TimeoutError(f"Service {url} not available after {max_wait} seconds")
+        time.sleep(delay)
+        delay = min(delay * 2, 1.0)
+
+
+def _encode(*, omit=(), **overrides) -> bytes:
+    """JSON body for the default payload, with fields overridden or omitted"""
+    if not overrides and not omit:
+        return _DEFAULT_BODY
+    payload = {**_DEFAULT_PAYLOAD, **overrides}
+    for field in omit:
+        payload.pop(field, None)
+    return orjson.dumps(payload)
+
+
+def _post(http: requests.Session, *, body: Optional[bytes] = None, omit=(), timeout=TIMEOUT,
+          record=True, **overrides) -> requests.Response:
+    """POST a pre-encoded body, or the default payload with fields overridden or omitted
+
+    Pass record=False for calls that are slow on purpose, so they stay out of
+    the latency gate.
+    """
+    if body is None:
+        body = _encode(omit=omit, **overrides)
+    start = time.perf_counter_ns()
+    response = http.post(WEBHOOK_URL, data=body, headers=_JSON_HEADERS, timeout=timeout)
+    if record:
+        _latencies.append(time.perf_counter_ns() - start)
+    return response
+
+
+@pytest.fixture(scope="session", autouse=True)
+def _n8n_ready_check():
+    """Wait for n8n once per test process instead of before every test"""
+    global _n8n_ready
+    if not _n8n_ready:
+        wait_for_service(N8N_URL + '/healthz')
+        _n8n_ready = True
+
+
+@pytest.fixture(scope="session", autouse=True)
+def _latency_gate():
+    """Fail the session if webhook p95 latency exceeds the budget
+
+    Samples are per process, so under xdist each worker gates only its own
+    calls and is skipped when it has fewer than LATENCY_MIN_SAMPLES.
+    """
+    yield
+    if not os.getenv('CI_PERF_GATE') or len(_latencies) < LATENCY_MIN_SAMPLES:
+        return
+    # Nearest-rank percentile
+    p95 = sorted(_latencies)[math.ceil(0.95 * len(_latencies)) - 1]
+    assert p95 < LATENCY_P95_BUDGET_MS * 1_000_000, \
+        f"webhook p95 {p95 / 1e6:.0f}ms exceeds {LATENCY_P95_BUDGET_MS}ms budget"
+
+
+@pytest.fixture(scope="session")
+def http():
+    """Keep-alive HTTP session shared by every test in the process"""
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_connections=32, pool_maxsize=32)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    yield session
+    session.close()
+
+
+# Overriding event_loop is the pytest-asyncio 0.21 way to widen the loop scope;
+# newer releases replace it with loop_scope (see the pin in requirements-test.txt)
+@pytest.fixture(scope="session")
+def event_loop():
+    """Session-wide event loop so async_http's pool outlives a single test"""
+    loop = asyncio.new_event_loop()
+    yield loop
+    loop.close()
+
+
+@pytest_asyncio.fixture(scope="session")
+async def async_http():
+    """Async HTTP client for burst tests, sharing one pool across the session"""
+    limits = httpx.Limits(max_connections=32, max_keepalive_connections=32)
+    async with httpx.AsyncClient(timeout=TIMEOUT, limits=limits) as client:
+        yield client
 
 
 class TestWebhookIntegration:
     """Test webhook endpoint integration"""
 
-    @pytest.fixture(autouse=True)
-    def setup(self):
-        """Setup before each test"""
-        # Wait for services to be ready
-        self.wait_for_service(N8N_URL + '/healthz')
-
-    def wait_for_service(self, url: str, max_attempts: int = 30):
-        """Wait for service to be available"""
-        for i in range(max_attempts):
-            try:
-                response = requests.get(url, timeout=2)
-                if response.status_code == 200:
-                    return
-            except requests.exceptions.RequestException:
-                pass
-            time.sleep(1)
-        raise TimeoutError(f"Service {url} not available after {max_attempts} seconds")
-
-    def test_webhook_health_check(self):
+    def test_webhook_health_check(self, http):
         """Test if webhook endpoint is accessible"""
-        response = requests.get(N8N_URL + '/healthz', timeout=TIMEOUT)
+        response = http.get(N8N_URL + '/healthz', timeout=TIMEOUT)
         assert response.status_code == 200
 
-    def test_valid_registration_request(self):
+    # Creates a user and an execution; keep away from the dedup/rate-limit tests
+    @pytest.mark.xdist_group("webhook_state")
+    def test_valid_registration_request(self, http):
         """Test webhook with valid registration data"""
-        payload = {
-            "email": f"test-{int(time.time())}@example.com",
-            "name": "Test User",
-            "passphrase": PASSPHRASE,
-            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
-            "formId": "test-form-001"
-        }
-
-        response = requests.post(
-            WEBHOOK_URL,
-            json=payload,
-            headers={'Content-Type': 'application/json'},
-            timeout=TIMEOUT
+        response = _post(
+            http,
+            email=f"test-{int(time.time())}@example.com",
+            timestamp=now_iso(),
+            formId="test-form-001"
         )
 
         assert response.status_code == 200
         data = response.json()
         assert data.get('success') is True
 
-    def test_invalid_passphrase_rejection(self):
+    def test_invalid_passphrase_rejection(self, http):
         """Test webhook rejects invalid passphrase"""
-        payload = {
-            "email": f"test-{int(time.time())}@example.com",
-            "name": "Test User",
-            "passphrase": "wrong_passphrase",
-            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime())
-        }
-
-        response = requests.post(
-            WEBHOOK_URL,
-            json=payload,
-            headers={'Content-Type': 'application/json'},
-            timeout=TIMEOUT
+        response = _post(
+            http,
+            email=f"test-{int(time.time())}@example.com",
+            passphrase="wrong_passphrase",
+            timestamp=_TS
         )
 
         assert response.status_code == 401
@@ -85,71 +204,26 @@ class TestWebhookIntegration:
         assert data.get('success') is False
         assert 'invalid' in data.get('error', '').lower()
 
-    def test_missing_required_fields(self):
+    def test_missing_required_fields(self, http):
         """Test webhook handles missing required fields"""
         # Test missing email
-        payload = {
-            "name": "Test User",
-            "passphrase": PASSPHRASE
-        }
-
-        response = requests.post(
-            WEBHOOK_URL,
-            json=payload,
-            headers={'Content-Type': 'application/json'},
-            timeout=TIMEOUT
-        )
-
+        response = _post(http, omit=("email",))
         assert response.status_code in [400, 500]
 
         # Test missing name
-        payload = {
-            "email": "test@example.com",
-            "passphrase": PASSPHRASE
-        }
-
-        response = requests.post(
-            WEBHOOK_URL,
-            json=payload,
-            headers={'Content-Type': 'application/json'},
-            timeout=TIMEOUT
-        )
-
+        response = _post(http, omit=("name",))
         assert response.status_code in [400, 500]
 
-    def test_invalid_email_format(self):
+    def test_invalid_email_format(self, http):
         """Test webhook validates email format"""
-        payload = {
-            "email": "not-an-email",
-            "name": "Test User",
-            "passphrase": PASSPHRASE
-        }
-
-        response = requests.post(
-            WEBHOOK_URL,
-            json=payload,
-            headers={'Content-Type': 'application/json'},
-            timeout=TIMEOUT
-        )
+        response = _post(http, email="not-an-email")
 
         # Should either reject at webhook or during processing
         assert response.status_code in [400, 500]
 
-    def test_webhook_handles_large_payload(self):
+    def test_webhook_handles_large_payload(self, http):
         """Test webhook handles large payloads gracefully"""
-        payload = {
-            "email": "test@example.com",
-            "name": "Test User",
-            "passphrase": PASSPHRASE,
-            "extra_data": "x" * 10000  # 10KB of extra data
-        }
-
-        response = requests.post(
-            WEBHOOK_URL,
-            json=payload,
-            headers={'Content-Type': 'application/json'},
-            timeout=TIMEOUT
-        )
+        response = _post(http, body=_LARGE_BODY)
 
         # Should still process successfully
         assert response.status_code in [200, 401]
@@ -159,11 +233,11 @@ class TestWebhookIntegration:
         "text/plain",
         "application/xml"
     ])
-    def test_webhook_content_type_handling(self, content_type):
+    def test_webhook_content_type_handling(self, http, content_type):
         """Test webhook handles different content types"""
         payload = "email=test@example.com&name=Test&passphrase=" + PASSPHRASE
 
-        response = requests.post(
+        response = http.post(
             WEBHOOK_URL,
             data=payload,
             headers={'Content-Type': content_type},
@@ -173,45 +247,35 @@ class TestWebhookIntegration:
         # Should handle or reject gracefully
         assert response.status_code in [200, 400, 401, 415]
 
-    def test_concurrent_webhook_requests(self):
+    async def test_concurrent_webhook_requests(self, async_http):
         """Test webhook handles concurrent requests"""
-        import concurrent.futures
-
-        def send_request(index):
-            payload = {
-                "email": f"concurrent-{index}-{int(time.time())}@example.com",
-                "name": f"Concurrent User {index}",
-                "passphrase": PASSPHRASE
-            }
+        bodies = [
+            _encode(
+                email=f"concurrent-{index}-{int(time.time())}@example.com",
+                name=f"Concurrent User {index}"
+            )
+            for index in range(5)
+        ]
 
-            response = requests.post(
+        responses = await asyncio.gather(*(
+            async_http.post(
                 WEBHOOK_URL,
-                json=payload,
-                headers={'Content-Type': 'application/json'},
-                timeout=TIMEOUT
+                content=body,
+                headers=_JSON_HEADERS
             )
-            return response.status_code
-
-        with concurrent.futures.ThreadPoolExecutor(max_workers=5) as executor:
-            futures = [executor.submit(send_request, i) for i in range(5)]
-            results = [f.result() for f in concurrent.futures.as_completed(futures)]
+            for body in bodies
+        ))
+        results = [response.status_code for response in responses]
 
         # All requests should be processed
         assert all(status in [200, 401, 429, 500] for status in results)
 
-    def test_webhook_response_format(self):
+    def test_webhook_response_format(self, http):
         """Test webhook returns consistent response format"""
-        payload = {
-            "email": f"format-test-{int(time.time())}@example.com",
-            "name": "Format Test",
-            "passphrase": PASSPHRASE
-        }
-
-        response = requests.post(
-            WEBHOOK_URL,
-            json=payload,
-            headers={'Content-Type': 'application/json'},
-            timeout=TIMEOUT
+        response = _post(
+            http,
+            email=f"format-test-{int(time.time())}@example.com",
+            name="Format Test"
         )
 
         assert response.headers.get('Content-Type', '').startswith('application/json')
@@ -222,54 +286,35 @@ class TestWebhookIntegration:
         else:
             assert 'error' in data
 
-    def test_webhook_idempotency(self):
+    # Shares dedup state on the webhook; keep on a single xdist worker
+    @pytest.mark.xdist_group("webhook_state")
+    def test_webhook_idempotency(self, http):
         """Test webhook handles duplicate requests gracefully"""
         email = f"idempotent-{int(time.time())}@example.com"
-        payload = {
-            "email": email,
-            "name": "Idempotent User",
-            "passphrase": PASSPHRASE
-        }
 
         # First request
-        response1 = requests.post(
-            WEBHOOK_URL,
-            json=payload,
-            headers={'Content-Type': 'application/json'},
-            timeout=TIMEOUT
-        )
+        response1 = _post(http, email=email, name="Idempotent User")
 
-        time.sleep(2)  # Wait a bit
-
-        # Second request with same data
-        response2 = requests.post(
-            WEBHOOK_URL,
-            json=payload,
-            headers={'Content-Type': 'application/json'},
-            timeout=TIMEOUT
-        )
+        # Second request with same data; no delay needed since the webhook
+        # only responds from the workflow's Respond to Webhook node
+        response2 = _post(http, email=email, name="Idempotent User")
 
         # Should handle duplicate gracefully
         assert response1.status_code == 200
         assert response2.status_code in [200, 409, 500]
 
-    def test_webhook_timeout_handling(self):
+    def test_webhook_timeout_handling(self, http):
         """Test webhook handles slow processing"""
-        payload = {
-            "email": f"timeout-test-{int(time.time())}@example.com",
-            "name": "Timeout Test",
-            "passphrase": PASSPHRASE,
-            # Add flag to simulate slow processing if workflow supports it
-            "test_mode": "slow"
-        }
-
         # Use short timeout to test handling
         try:
-            response = requests.post(
-                WEBHOOK_URL,
-                json=payload,
-                headers={'Content-Type': 'application/json'},
-                timeout=2  # Short timeout
+            response = _post(
+                http,
+                timeout=2,  # Short timeout
+                record=False,  # Slow on purpose; keep out of the latency gate
+                email=f"timeout-test-{int(time.time())}@example.com",
+                name="Timeout Test",
+                # Add flag to simulate slow processing if workflow supports it
+                test_mode="slow"
             )
             # If it completes, should be successful
             assert response.status_code in [200, 401]
@@ -278,23 +323,12 @@ class TestWebhookIntegration:
             pass
 
     @pytest.mark.skip(reason="Requires special characters testing")
-    def test_webhook_special_characters(self):
+    def test_webhook_special_characters(self, http):
         """Test webhook handles special characters in input"""
         special_chars = ["'", '"', "<", ">", "&", "\\", "/", "%", "\n", "\r", "\t"]
 
         for char in special_chars:
-            payload = {
-                "email": f"test{char}user@example.com",
-                "name": f"Test{char}User",
-                "passphrase": PASSPHRASE
-            }
-
-            response = requests.post(
-                WEBHOOK_URL,
-                json=payload,
-                headers={'Content-Type': 'application/json'},
-                timeout=TIMEOUT
-            )
+            response = _post(http, email=f"test{char}user@example.com", name=f"Test{char}User")
 
             # Should handle or reject gracefully
             assert response.status_code in [200, 400, 401]
@@ -303,79 +337,59 @@ class TestWebhookIntegration:
 class TestWebhookSecurity:
     """Security-focused webhook tests"""
 
-    def test_sql_injection_protection(self):
+    @pytest.mark.parametrize("injection", [
+        "'; DROP TABLE users; --",
+        "1' OR '1'='1",
+        "admin'--",
+        "' UNION SELECT * FROM users--"
+    ])
+    def test_sql_injection_protection(self, http, injection):
         """Test webhook protects against SQL injection"""
-        payloads = [
-            "'; DROP TABLE users; --",
-            "1' OR '1'='1",
-            "admin'--",
-            "' UNION SELECT * FROM users--"
-        ]
-
-        for injection in payloads:
-            payload = {
-                "email": f"{injection}@example.com",
-                "name": injection,
-                "passphrase": PASSPHRASE
-            }
-
-            response = requests.post(
-                WEBHOOK_URL,
-                json=payload,
-                headers={'Content-Type': 'application/json'},
-                timeout=TIMEOUT
-            )
+        response = _post(http, email=f"{injection}@example.com", name=injection)
 
-            # Should reject or sanitize
-            assert response.status_code in [400, 401, 500]
+        # Should reject or sanitize
+        assert response.status_code in [400, 401, 500]
 
-    def test_xss_protection(self):
+    @pytest.mark.parametrize("xss", [
+        "<script>alert('xss')</script>",
+        "javascript:alert('xss')",
+        "<img src=x onerror=alert('xss')>",
+        "<svg onload=alert('xss')>"
+    ])
+    def test_xss_protection(self, http, xss):
         """Test webhook protects against XSS"""
-        xss_payloads = [
-            "<script>alert('xss')</script>",
-            "javascript:alert('xss')",
-            "<img src=x onerror=alert('xss')>",
-            "<svg onload=alert('xss')>"
-        ]
-
-        for xss in xss_payloads:
-            payload = {
-                "email": "test@example.com",
-                "name": xss,
-                "passphrase": PASSPHRASE
-            }
-
-            response = requests.post(
-                WEBHOOK_URL,
-                json=payload,
-                headers={'Content-Type': 'application/json'},
-                timeout=TIMEOUT
+        response = _post(http, name=xss)
+
+        # Should sanitize or reject
+        if response.status_code == 200:
+            data = response.json()
+            # Check that script tags are not in response
+            assert '<script>' not in str(data)
+
+    # Shares the rate-limit window on the webhook; keep on a single xdist worker
+    @pytest.mark.xdist_group("webhook_state")
+    @pytest.mark.stress
+    @pytest.mark.skipif(not os.getenv('RUN_STRESS'), reason="stress test, set RUN_STRESS=1 to run")
+    async def test_rate_limiting(self, async_http):
+        """Test webhook has rate limiting"""
+        bodies = [
+            _encode(
+                email=f"ratelimit-{index}@example.com",
+                name=f"Rate Limit {index}"
             )
+            for index in range(20)
+        ]
 
-            # Should sanitize or reject
-            if response.status_code == 200:
-                data = response.json()
-                # Check that script tags are not in response
-                assert '<script>' not in str(data)
-
-    def test_rate_limiting(self):
-        """Test webhook has rate limiting"""
-        # Send many requests quickly
-        results = []
-        for i in range(20):
-            payload = {
-                "email": f"ratelimit-{i}@example.com",
-                "name": f"Rate Limit {i}",
-                "passphrase": PASSPHRASE
-            }
-
-            response = requests.post(
+        # Send all requests at once so the burst actually hits the limiter
+        responses = await asyncio.gather(*(
+            async_http.post(
                 WEBHOOK_URL,
-                json=payload,
-                headers={'Content-Type': 'application/json'},
-                timeout=TIMEOUT
+                content=body,
+                headers=_JSON_HEADERS
             )
-            results.append(response.status_code)
+            for body in bodies
+        ))
+        results = [response.status_code for response in responses]
 
         # Some requests should be rate limited
         rate_limited = any(status == 429 for status in results)